@@ -2,18 +2,20 @@
 
 # ref: https://kodi.wiki/view/NFO_files/Episodes
 
+import functools
 import logging
 import os
 import re
-import xml.etree.ElementTree as ET
 import hashlib
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
+from xml.sax.saxutils import escape
 
 
 cwd = u'.'
 overwrite = False
 outputEmptyElements = True
-containers = [
+containers = frozenset([
     '.avchd',
     '.avi',
     '.flv', '.swf', '.f4v',
@@ -24,7 +26,7 @@ containers = [
     '.ogg',
     '.webm',
     '.wmv',
-]
+])
 extraElements = [
     'plot',
     'credits',
@@ -88,7 +90,12 @@ class EpisodeNfo(object):
         self.uniqueIdType = uniqueIdType
         self.indent = '  '
         self.episode = None  # Optional[EpisodeEntity]
-        self.xmlTree = None  # Optional[ET]
+
+        # Identical for every file exported through this object.
+        self.extrasXml = ''  # type: str
+        if emptyElements:
+            self.extrasXml = ''.join(f'{self.indent}<{el}></{el}>\n'
+                                     for el in extraElements)
 
     @property
     def basename(self) -> Optional[str]:
@@ -99,152 +106,116 @@ class EpisodeNfo(object):
     def path(self) -> str:
         return os.path.join(self.dirName, self.fileRoot + self.EXTENSION)
 
-    def buildNfo(self) -> None:
-        self.xmlTree = ET.Element('episodedetails')
-
-        ET.SubElement(self.xmlTree, 'title').text = self.episode.episodeTitle
-
-        if self.emptyElements or episode.seasonNumber is not None:
-            ET.SubElement(self.xmlTree, 'season').text = str(
-                episode.seasonNumber if episode.seasonNumber is not None
-                else '')
-
-        if self.emptyElements or episode.episodeNumber is not None:
-            ET.SubElement(self.xmlTree, 'episode').text = str(
-                episode.episodeNumber if episode.episodeNumber is not None
-                else '')
-
-        uniqueId = ET.SubElement(self.xmlTree, 'uniqueid')
-        uniqueId.set('type', self.uniqueIdType)
-        uniqueId.text = self.generateId()
-
-        if self.emptyElements:
-            for el in self.extraElements:
-                ET.SubElement(self.xmlTree, el)
-
     def generateId(self) -> str:
         if self.uniqueIdSource == 'filename':
-            source = self.fileRoot + self.fileExtension
-        elif self.uniqueIdSource == 'absolute':
-            source = os.path.abspath(os.path.join(self.dirName, self.fileRoot
-                                                  + self.fileExtension))
+            digest = BLANK_DIGEST.copy()
         else:
-            source = os.path.join(self.dirName, self.fileRoot
-                                  + self.fileExtension)
-        return hashlib.md5(source.encode('utf-8')).hexdigest()
-
-    def export(self) -> None:
-        if self.xmlTree is None:
-            self.buildNfo()
-
-        # Python 3.9 would support indentation and standalone argument. Sigh.
-        self._prettify(self.xmlTree)
-        xmlStr = self.DECLARATION + "\n" + ET.tostring(
-            self.xmlTree,
-            encoding='utf-8',
-            short_empty_elements=False).decode('utf-8')
-        print(xmlStr)
-        # return
-
-        try:
-            with open(self.path, 'w') as outfile:
-                outfile.write(xmlStr)
-                written.append(self.path)
-        except IOError:
-            logging.warning("NFO export failure: %s", IOError)
-
-    def _prettify(self, current: ET, parent: ET = None, index: int = -1,
-                  depth: int = 0) -> None:
-        # see: https://stackoverflow.com/a/65808327
-        for i, node in enumerate(current):
-            self._prettify(node, current, i, depth + 1)
-        if parent is not None:
-            if index == 0:
-                parent.text = "\n" + ("  " * depth)
-            else:
-                parent[index - 1].tail = "\n" + ("  " * depth)
-            if index == len(parent) - 1:
-                current.tail = "\n" + ("  " * (depth - 1))
+            digest = hashDirectory(self.dirName,
+                                   self.uniqueIdSource == 'absolute').copy()
+        digest.update(os.fsencode(self.fileRoot + self.fileExtension))
+        return digest.hexdigest()
+
+    def export(self) -> str:
+        # The schema is fixed, so write the document directly rather than
+        # building and prettifying an element tree for every file.
+        episode = self.episode
+        indent = self.indent
+        title = escape(episode.episodeTitle or '')
+        uniqueIdType = escape(self.uniqueIdType, {'"': '&quot;'})
+
+        return (f'{self.DECLARATION}\n'
+                f'<episodedetails>\n'
+                f'{indent}<title>{title}</title>\n'
+                f'{self._optionalElement("season", episode.seasonNumber)}'
+                f'{self._optionalElement("episode", episode.episodeNumber)}'
+                f'{indent}<uniqueid type="{uniqueIdType}">'
+                f'{self.generateId()}</uniqueid>\n'
+                f'{self.extrasXml}'
+                f'</episodedetails>')
+
+    def _optionalElement(self, tag: str, value: Optional[int]) -> str:
+        if value is None:
+            if not self.emptyElements:
+                return ''
+            value = ''
+        return f'{self.indent}<{tag}>{value}</{tag}>\n'
 
 
 class DirectoryParser(object):
 
+    # Most specific first: literal prefixes let the common case exit early.
+    # As with FileParser, all alternatives share one match and group names
+    # carry the alternative's index.
     REGEXES = [
-        # 01. Description
-        # 2-Description
-        # 003 Description
-        # 02Ignored
-        r'^(?P<seasonNumber>\d+)',
-
-        # Season 01
-        # Chapter 2
-        # Ignored 100
-        r'\W+\s+(?P<seasonNumber>\d+)$',
-
         # Specials
-        r'^(?P<seasonSpecials>Specials)',
+        r'(?P<seasonSpecials1>Specials)',
 
+        # Season 01
         # Season 01: Description
         # Season 2 - Description
         # Chapter 030 Ignored
-        r'^[Season|Lesson|Chapter|Part]\W+\s+(?P<seasonNumber>\d+)',
+        r'(?:Season|Lesson|Chapter|Part)\W*(?P<seasonNumber2>\d+)',
+
+        # 01. Description
+        # 2-Description
+        # 003 Description
+        # 02Ignored
+        r'(?P<seasonNumber3>\d+)',
+
+        # - 100
+        r'\W+\s+(?P<seasonNumber4>\d+)$',
     ]  # type: list
 
+    # Applied with match(), so every alternative is anchored at the start.
+    REGEX_COMPILED = re.compile('|'.join(REGEXES), flags=re.IGNORECASE)
+
     def __init__(self, directory: str) -> None:
         self.seasonNumber = None  # type: Optional[int]
 
         self._directory = None  # type: Optional[str]
-        self.__regexesCompiled = []  # type: list
 
-        self.compileRegexes(self.REGEXES, self.__regexesCompiled)
         self.directory(directory)
 
     def directory(self, value: str) -> None:
         self._directory = value
         self.parse()
 
-    def compileRegexes(self, regexes: list, compiled: list) -> None:
-        for regex in regexes:
-            compiled.append(re.compile(regex, flags=re.IGNORECASE))
-
     def parse(self) -> None:
         self.seasonNumber = None
-        for regex in self.__regexesCompiled:
-            m = regex.match(self._directory)
-            if m is not None:
-                d = m.groupdict()
-                if 'seasonNumber' in d:
-                    self.seasonNumber = int(d['seasonNumber'])
-                if 'seasonSpecials' in d:
-                    self.seasonNumber = 0
-                break
+        m = self.REGEX_COMPILED.match(self._directory)
+        if m is not None:
+            # Each alternative has a single group.
+            if m.lastgroup.startswith('seasonSpecials'):
+                self.seasonNumber = 0
+            else:
+                self.seasonNumber = int(m.group(m.lastgroup))
 
 
 class FileParser(object):
 
+    # One alternative per layout, tried in order within a single match. Group
+    # names carry the alternative's index since they must be unique.
     REGEXES = [
         # 1x01. Title
         # 2x15 - Title
         # 3x15 Title
-        r'''
-            ^(?P<seasonNumber>\d+)[-\.x](?P<episodeNumber>\d{2,})\W*\s*
-            (?P<episodeTitle>.+)$
-        ''',
+        r'(?P<seasonNumber1>\d+)[-\.x](?P<episodeNumber1>\d{2,})\W*\s*'
+        r'(?P<episodeTitle1>.+)',
 
         # 01. Title
         # 02 - Title
         # 03 Title
-        r'^(?P<episodeNumber>\d{2,})\W*\s*(?P<episodeTitle>.+)$',
+        r'(?P<episodeNumber2>\d{2,})\W*\s*(?P<episodeTitle2>.+)',
 
         # Name.S01E02.Title
         # Name - s01e02 - Title
-        r'''
-            s(?P<seasonNumber>\d{2,})e(?P<episodeNumber>\d{2,})\s?\W*\s*
-            (?P<episodeTitle>.+)$
-        ''',
-        # r'(.+)$',
+        r'.*s(?P<seasonNumber3>\d{2,})e(?P<episodeNumber3>\d{2,})\s?\W*\s*'
+        r'(?P<episodeTitle3>.+)',
     ]  # type: list
 
+    # Applied with fullmatch(), so no anchors are needed.
+    REGEX_COMPILED = re.compile('|'.join(REGEXES), flags=re.IGNORECASE)
+
     def __init__(self, file: str, episodeTitle: str = None,
                  seasonNumber: int = None) -> None:
         self.seasonNumber = seasonNumber  # type: Optional[int]
@@ -254,97 +225,204 @@ class FileParser(object):
         self._file = None  # type: Optional[str]
         self._seasonNumber = self.seasonNumber
         self._episodeTitle = self.episodeTitle
-        self.__regexesCompiled = []  # type: list
 
-        self.compileRegexes(self.REGEXES, self.__regexesCompiled)
         self.file(file)
 
     def file(self, value: str) -> None:
         self._file = value
         self.parse()
 
-    def compileRegexes(self, regexes: list, compiled: list) -> None:
-        for regex in regexes:
-            compiled.append(re.compile(regex,
-                                       flags=re.IGNORECASE | re.VERBOSE))
-
     def parse(self) -> None:
         # print(self._file)
         self.episodeTitle = self._episodeTitle
         self.episodeNumber = None
         self.seasonNumber = self._seasonNumber
-        for regex in self.__regexesCompiled:
-            m = regex.match(self._file)
-            if m is not None:
-                d = m.groupdict()
-                if 'seasonNumber' in d:
-                    self.seasonNumber = int(d['seasonNumber'])
-                if 'episodeNumber' in d:
-                    self.episodeNumber = int(d['episodeNumber'])
-                if 'episodeTitle' in d:
-                    self.episodeTitle = d['episodeTitle']
-                break
-
-
-# logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
-logging.basicConfig(level=logging.DEBUG)
-
-for root, dirs, files in os.walk(cwd):
-    # print('------------------------: ' + os.path.basename(root))
-
-    directoryParser = DirectoryParser(directory=os.path.basename(root))
-    logging.debug('Season number: %s', directoryParser.seasonNumber)
-
-    for file in sorted(files):
-        fileRoot, fileExtension = os.path.splitext(file)
-
-        if not len(fileExtension):
-            logging.debug('Dotfile will not be processed: %s',
-                          os.path.join(root, file))
+        m = self.REGEX_COMPILED.fullmatch(self._file)
+        if m is not None:
+            d = m.groupdict()
+            # Every alternative ends with its title group.
+            index = m.lastgroup[len('episodeTitle'):]
+            if d.get('seasonNumber' + index) is not None:
+                self.seasonNumber = int(d['seasonNumber' + index])
+            if d.get('episodeNumber' + index) is not None:
+                self.episodeNumber = int(d['episodeNumber' + index])
+            self.episodeTitle = d['episodeTitle' + index]
+
+
+@functools.lru_cache(maxsize=4096)
+def parseDirectory(basename: str) -> Optional[int]:
+    # Season folder names repeat across shows, so parse each only once.
+    return DirectoryParser(directory=basename).seasonNumber
+
+
+# Copying a ready hash state is a little cheaper than setting up a new one.
+BLANK_DIGEST = hashlib.md5()
+
+
+@functools.lru_cache(maxsize=256)
+def hashDirectory(dirName: str, absolute: bool = False) -> 'hashlib._Hash':
+    # Files in a directory share its path as a prefix: encode and hash it
+    # once, then let each file copy the state and append its own name.
+    if absolute:
+        dirName = os.path.abspath(dirName)
+    digest = BLANK_DIGEST.copy()
+    digest.update(os.fsencode(os.path.join(dirName, '')))
+    return digest
+
+
+def iterTree(path: str) -> Iterator[Tuple[str, list]]:
+    # Like os.walk(), minus the per-directory bookkeeping: the DirEntry
+    # type cache from scandir answers every file/directory question.
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # As in os.walk(), an entry that cannot be inspected counts
+                # as a file instead of losing the whole directory.
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if not isDir:
+                    files.append(entry.name)
+                    continue
+
+                try:
+                    isSymlink = entry.is_symlink()
+                except OSError:
+                    isSymlink = False
+                if not isSymlink:
+                    subdirs.append(entry.path)
+    except OSError as e:
+        logging.warning("Directory cannot be read: %s", e)
+        return
+
+    yield path, files
+    for subdir in subdirs:
+        yield from iterTree(subdir)
+
+
+# Each worker process fills in and exports the same pair of objects for
+# every file it handles rather than allocating new ones.
+workerNfo = EpisodeNfo(
+    emptyElements=outputEmptyElements,
+    extraElements=extraElements,
+    uniqueIdSource=uniqueIdSource,
+    uniqueIdType=uniqueIdType,
+    )
+workerNfo.episode = EpisodeEntity()
+
+
+def processFile(dirName: str, fileRoot: str, fileExtension: str,
+                seasonNumber: Optional[int]) -> Tuple[str, bytes]:
+    # Runs in a worker process: only plain values go in and come out.
+    nfo = workerNfo
+    nfo.dirName = dirName
+    nfo.fileRoot = fileRoot
+    nfo.fileExtension = fileExtension
+
+    fileParser = FileParser(file=fileRoot,
+                            seasonNumber=seasonNumber,
+                            episodeTitle=fileRoot)
+
+    # The parser already hands back a str and ints (or None), so skip the
+    # converting property setters.
+    episode = nfo.episode
+    episode._episodeTitle = fileParser.episodeTitle.strip()
+    episode._episodeNumber = fileParser.episodeNumber
+    episode._seasonNumber = fileParser.seasonNumber
+
+    return nfo.path, nfo.export().encode('utf-8')
+
+
+def writeNfo(path: str, data: bytes) -> None:
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('NFO file: %s\n%s', path, data.decode('utf-8'))
+    # The bytes are already UTF-8, as the declaration promises, and well
+    # under a block in size: one write() on a raw descriptor normally does.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                 | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            count = os.write(fd, view)
+            if not count:
+                raise OSError("Short write to %s" % path)
+            view = view[count:]
+    finally:
+        os.close(fd)
+
+
+if __name__ == '__main__':
+    # logging.basicConfig(format='%(levelname)s: %(message)s',
+    #                     level=logging.DEBUG)
+    logging.basicConfig(level=logging.DEBUG)
+
+    # Pending work, one column per processFile() argument.
+    dirNames = []  # type: list
+    fileRoots = []  # type: list
+    fileExtensions = []  # type: list
+    seasonNumbers = []  # type: list
+
+    for root, files in iterTree(cwd):
+        # print('------------------------: ' + os.path.basename(root))
+
+        existing = set(files)
+        start = len(fileRoots)
+        for file in sorted(files):
+            fileRoot, fileExtension = os.path.splitext(file)
+
+            if not len(fileExtension):
+                logging.debug('Dotfile will not be processed: %s',
+                              os.path.join(root, file))
+                continue
+
+            fileExtension = fileExtension.lower()
+            if fileExtension == EpisodeNfo.EXTENSION:
+                continue
+
+            if fileExtension not in containers:
+                logging.debug('File type not supported: %s',
+                              os.path.join(root, file))
+                continue
+
+            # Re-runs mostly find existing NFO files: rule them out before
+            # anything gets parsed or hashed.
+            nfoName = fileRoot + EpisodeNfo.EXTENSION
+            if not overwrite and nfoName in existing:
+                logging.debug('NFO file already exists: %s',
+                              os.path.join(root, nfoName))
+                skipped.append(os.path.join(root, nfoName))
+                continue
+
+            fileRoots.append(fileRoot)
+            fileExtensions.append(fileExtension)
+
+        pending = len(fileRoots) - start
+        if not pending:
             continue
 
-        fileExtension = fileExtension.lower()
-        if fileExtension == EpisodeNfo.EXTENSION:
-            continue
-
-        if fileExtension not in containers:
-            logging.debug('File type not supported: %s',
-                          os.path.join(root, file))
-            continue
-
-        nfo = EpisodeNfo(
-            dirName=root,
-            fileRoot=fileRoot,
-            fileExtension=fileExtension,
-            emptyElements=outputEmptyElements,
-            extraElements=extraElements,
-            uniqueIdSource=uniqueIdSource,
-            uniqueIdType=uniqueIdType,
-            )
-
-        if not overwrite and nfo.basename in files:
-            logging.debug('NFO file already exists: %s', nfo.path)
-            skipped.append(nfo.path)
-            continue
-
-        fileParser = FileParser(file=fileRoot,
-                                seasonNumber=directoryParser.seasonNumber,
-                                episodeTitle=fileRoot)
-
-        episode = EpisodeEntity()
-        episode.episodeTitle = fileParser.episodeTitle
-        episode.episodeNumber = fileParser.episodeNumber
-        episode.seasonNumber = fileParser.seasonNumber
-
-        nfo.episode = episode
-        try:
-            nfo.export()
-            written.append(nfo.path)
-        except IOError:
-            logging.warning("NFO export failure: %s", IOError)
-        total += 1
-
-
-print("total: " + str(total))
-print("skipped: " + str(len(skipped)))
-print("written: " + str(len(written)))
+        seasonNumber = parseDirectory(os.path.basename(root))
+        logging.debug('Season number: %s', seasonNumber)
+
+        dirNames.extend([root] * pending)
+        seasonNumbers.extend([seasonNumber] * pending)
+
+    if dirNames:
+        # One bulk pass over the whole run; results are written on the main
+        # process as they come back.
+        with ProcessPoolExecutor() as executor:
+            for path, data in executor.map(processFile, dirNames, fileRoots,
+                                           fileExtensions, seasonNumbers,
+                                           chunksize=64):
+                try:
+                    writeNfo(path, data)
+                    written.append(path)
+                except IOError as e:
+                    logging.warning("NFO export failure: %s", e)
+                total += 1
+
+    print("total: " + str(total))
+    print("skipped: " + str(len(skipped)))
+    print("written: " + str(len(written)))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from main import DirectoryParser, FileParser
+
+
+class DirectoryParserTest(unittest.TestCase):
+
+    def assertSeason(self, directory: str, seasonNumber) -> None:
+        self.assertEqual(DirectoryParser(directory).seasonNumber,
+                         seasonNumber, directory)
+
+    def test_keyword(self) -> None:
+        self.assertSeason('Season 01', 1)
+        self.assertSeason('Season 2 - Foo', 2)
+        self.assertSeason('Part.4', 4)
+
+    def test_specials(self) -> None:
+        self.assertSeason('Specials', 0)
+
+    def test_leading_number(self) -> None:
+        self.assertSeason('02. Second', 2)
+
+    def test_trailing_number(self) -> None:
+        self.assertSeason('- 7', 7)
+
+    def test_no_match(self) -> None:
+        self.assertSeason('Extras', None)
+
+
+class FileParserTest(unittest.TestCase):
+
+    def assertParsed(self, file: str, seasonNumber, episodeNumber,
+                     episodeTitle: str) -> None:
+        parser = FileParser(file=file, seasonNumber=None, episodeTitle=file)
+        self.assertEqual(
+            (parser.seasonNumber, parser.episodeNumber, parser.episodeTitle),
+            (seasonNumber, episodeNumber, episodeTitle), file)
+
+    def test_season_x_episode(self) -> None:
+        self.assertParsed('1x01. Pilot', 1, 1, 'Pilot')
+        self.assertParsed('2x15 - Title', 2, 15, 'Title')
+
+    def test_episode(self) -> None:
+        self.assertParsed('02 - Second', None, 2, 'Second')
+
+    def test_season_episode_tag(self) -> None:
+        self.assertParsed('Show.S01E03.Third', 1, 3, 'Third')
+        self.assertParsed('Show - s01e03 - Third', 1, 3, 'Third')
+
+    def test_no_match(self) -> None:
+        self.assertParsed('Just a movie', None, None, 'Just a movie')
+
+    def test_directory_season_kept(self) -> None:
+        parser = FileParser(file='02 - Second', seasonNumber=4,
+                            episodeTitle='02 - Second')
+        self.assertEqual(parser.seasonNumber, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()